@@ -1,108 +1,759 @@
 from __future__ import print_function, division
 
+from functools import partial
+from multiprocessing import resource_tracker
+from multiprocessing.pool import ExceptionWithTraceback
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.shared_memory import SharedMemory
 from numbers import Integral
+import collections
+import io
+import itertools
 import multiprocessing
+import os
+import pickle
+import queue
 import time
 import sys
+import threading
+import weakref
 
 import numpy as np
 
+# Counter giving each batch of jobs a unique token and the latest payload unpickled in a worker, see _payload
+_BATCH_COUNTER = itertools.count()
+_PAYLOAD = (None, None)
+
+# Results with out-of-band buffers of at least this number of bytes are returned through shared memory, see _pack
+_SHM_RESULT_SIZE = 2**20
+
+# Pickled functions and keyword arguments of at least this number of bytes are sent through shared memory, see _payload
+_SHM_PAYLOAD_SIZE = 2**20
+
+# Interval in seconds between the checks that the worker processes are still alive while waiting for results
+_WORKER_CHECK_INTERVAL = 1.
+
+
+def _default_cpus():
+    """
+    Returns the number of cpus the process is allowed to run on. On Linux this respects the affinity mask set by, for
+    instance, containers and batch systems, where multiprocessing.cpu_count returns all cpus of the host
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def _create_pool(cpus, initializer=None, initargs=()):
+    # The resource tracker is started before the workers are created so that the shared memory blocks created by the
+    # workers, see _pack, are registered in the same tracker as the parent process that unlinks them
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+    return _pool_context().Pool(processes=cpus, initializer=initializer, initargs=initargs)
+
+
+def _pool_context():
+    """
+    Returns the multiprocessing context used to start the workers. On Linux the workers are forked so that the modules
+    and data of the parent process are inherited instead of being imported and pickled again in each worker. Other
+    platforms use forkserver where it is available as fork is not safe on macOS, the functions run by the workers must
+    then be importable, i.e. defined at module level
+    """
+    if sys.platform.startswith("linux"):
+        return multiprocessing.get_context("fork")
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context()
+
+
+def _terminate_pool(worker_pool):
+    worker_pool.terminate()
+    worker_pool.join()
+
+
+def _dispatch(jobs):
+    """
+    Runs a chunk of jobs in a worker process. As the chunks are completed in arbitrary order the index of each job is
+    returned together with a flag telling if the job succeeded and the result or the raised exception
+    """
+    results = []
+    for index, function, arguments, kwarguments in jobs:
+        try:
+            results.append((index, True, _pack(function(*arguments, **kwarguments))))
+        except Exception as e:
+            results.append((index, False, ExceptionWithTraceback(e, e.__traceback__)))
+    return results
+
+
+def _job_args(jobs):
+    """
+    Assembles the command for each job as a tuple (index, function, arguments, key word arguments) where None arguments
+    are replaced with empty ones
+    """
+    try:
+        return [(i, job[0], () if job[1] is None else job[1], {} if job[2] is None else job[2])
+                for i, job in enumerate(jobs)]
+    except (IndexError, TypeError):
+        print(" ERROR: multiProcessor - The received arguments could not be interpreted")
+        print("        The data must be on the following form:")
+        print("        [  ( functionReference, arguments, key word arguments as dictionary )\n\t , "
+              "( myFun,[x,y,z], {'a':2 ,'b':3} ) \n\t ,  (myFun2, None, None),   ]\n")
+        raise
+
+
+class _Submission(object):
+    """
+    Submits the chunks of jobs to a worker pool from the calling thread. A chunk is only submitted when less than
+    max_in_flight chunks are submitted but not yet collected and delay seconds have passed since the previous chunk. The
+    task handler thread of the pool, which is shared by all users of the pool, is therefore never blocked by the
+    backpressure or the delay of one call. The results of the chunks are put on a queue by the result handler thread
+    until stop is called, after that the results are discarded. lost is the number of chunks taken to be lost as the
+    workers running them have exited abnormally
+    """
+    def __init__(self, worker_pool, chunks, delay, max_in_flight):
+        self.worker_pool = worker_pool
+        self.chunks = chunks
+        self.delay = delay
+        self.max_in_flight = max_in_flight
+        self.submitted = 0
+        self.received = 0
+        self.collected = 0
+        self.lost = 0
+        # The workers of the pool, the pool replaces workers that exit, and the ones that had exited before the start
+        self.workers = set(worker_pool._pool)
+        self.exited_workers = set(worker for worker in self.workers if worker.exitcode is not None)
+        self.next_submission = time.monotonic()
+        self.results = queue.Queue()
+        self.received_condition = threading.Condition()
+        self.stopped = False
+
+    def submit(self):
+        """
+        Submits the chunks that can be submitted now. Returns the time until the next chunk can be submitted, or None if
+        no more chunk can be submitted before a chunk is collected
+        """
+        while (self.submitted < len(self.chunks) and
+               self.submitted - self.collected - self.lost < self.max_in_flight):
+            now = time.monotonic()
+            if now < self.next_submission:
+                return self.next_submission - now
+            self.worker_pool.apply_async(_dispatch, (self.chunks[self.submitted],), callback=self.put,
+                                         error_callback=self.put_error)
+            self.submitted += 1
+            self.next_submission = now + self.delay
+        return None
+
+    def put(self, chunk_results):
+        with self.received_condition:
+            if self.stopped:
+                _discard_chunk(chunk_results)
+            else:
+                self.results.put(chunk_results)
+            self.received += 1
+            self.received_condition.notify_all()
+
+    def put_error(self, error):
+        # The results of a chunk could not be sent back to the parent process, for instance as they could not be pickled
+        self.put([(None, False, error)])
+
+    def finished(self):
+        """
+        Returns True if all chunks are collected, except for chunks that are lost
+        """
+        return (self.submitted == len(self.chunks) and self.received == self.collected and
+                len(self.chunks) - self.collected <= self.lost)
+
+    def lost_workers(self):
+        """
+        Returns the number of workers that have exited abnormally since the start. Workers of pools with
+        maxtasksperchild exit normally with exit code 0 after their tasks are completed
+        """
+        self.workers.update(list(self.worker_pool._pool))
+        return sum(1 for worker in self.workers - self.exited_workers if worker.exitcode not in (None, 0))
+
+    def next(self, timeout):
+        """
+        Returns the results of the next completed chunk, raises queue.Empty if no chunk is completed within timeout
+        """
+        chunk_results = self.results.get(timeout=timeout)
+        self.collected += 1
+        return chunk_results
+
+    def stop(self):
+        """
+        Discards the results not collected and the results of the chunks that are completed later, for instance after
+        a timeout or when an iterator over the results is closed, so that their shared memory blocks are unlinked
+        """
+        with self.received_condition:
+            self.stopped = True
+        while True:
+            try:
+                _discard_chunk(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+    def wait(self, deadline):
+        """
+        Waits until the results of all submitted chunks, except the lost ones, are received or the deadline is passed.
+        The pool can then be terminated without losing results holding shared memory blocks
+        """
+        with self.received_condition:
+            while self.received + self.lost_workers() < self.submitted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                self.received_condition.wait(_WORKER_CHECK_INTERVAL if remaining is None
+                                             else min(remaining, _WORKER_CHECK_INTERVAL))
+
+
+class _WorkerExitedError(RuntimeError):
+    """
+    Raised when a worker process has exited abnormally, for instance killed by a signal, as the chunk it was running
+    is lost
+    """
+
+
+def _discard_chunk(chunk_results):
+    _discard([value for _, success, value in chunk_results if success])
+
+
+def _run_jobs(worker_pool, job_args, cpus, timeout, info, stop_on_error, terminate, delay=0, max_in_flight=None,
+              unpack=True, chunksize=None, iter_results=False, wait_on_stop=False):
+    """
+    Submits the jobs in chunks to the worker pool and collects the results as the chunks are completed
+
+    :param worker_pool:     The pool to run the jobs in
+    :param job_args:        List of (index, function, arguments, key word arguments) for each job, see _job_args
+    :param cpus:            Number of processes in the pool, used to determine the chunk size
+    :param timeout:         Maximum time to wait for all jobs to complete, None to wait without a time limit
+    :param info:            Print the progress
+    :param stop_on_error:   If True terminate is called and the error raised if a job fails, otherwise the result of
+                            that job is replaced with False
+    :param terminate:       Function that stops the worker pool
+    :param delay:           Delay between submission of chunks
+    :param max_in_flight:   Maximum number of chunks submitted to the pool but not yet collected, None for 4*cpus
+    :param unpack:          If False the results are returned as packed by the workers, see _pack
+    :param chunksize:       Number of jobs submitted together to a worker, None for len(job_args)//(4*cpus)
+    :param iter_results:    If True an iterator yielding the results is returned instead of a list
+    :param wait_on_stop:    If True the chunks still running when the collection stops are waited for until the
+                            deadline, used when the pool is terminated after the call, see _Submission.wait
+
+    :return:                A list, or an iterator, with the results in the same order as job_args
+    """
+    if chunksize is None:
+        chunksize = len(job_args)//(4*cpus)
+    chunksize = max(1, chunksize)
+    chunks = [job_args[i:i + chunksize] for i in range(0, len(job_args), chunksize)]
+    submission = _Submission(worker_pool, chunks, delay, 4*cpus if max_in_flight is None else max(max_in_flight, 1))
+    # Nothing is submitted before the first result is requested, an iterator that is never started therefore leaves no
+    # chunks running in the pool
+    job_results = _collect_results(submission, len(job_args), timeout, info, stop_on_error, terminate,
+                                   unpack, wait_on_stop)
+    if iter_results:
+        return _ordered_results(job_results, len(job_args))
+    results = [False]*len(job_args)
+    try:
+        for index, value in job_results:
+            results[index] = value
+    except:
+        # The packed results already collected will never be unpacked
+        if not unpack:
+            _discard(results)
+        raise
+    return results
+
+
+def _next_chunk(submission, deadline):
+    """
+    Submits chunks as slots become free and waits for the next completed chunk, returns None when all chunks are
+    collected. Raises multiprocessing.TimeoutError if the deadline is passed and _WorkerExitedError if a worker has
+    exited abnormally, the chunk it was running is then counted as lost
+    """
+    while True:
+        wait = submission.submit()
+        if submission.finished():
+            return None
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        timeout = min(t for t in (wait, remaining, _WORKER_CHECK_INTERVAL) if t is not None)
+        try:
+            return submission.next(timeout)
+        except queue.Empty:
+            if remaining is not None and remaining <= timeout:
+                raise multiprocessing.TimeoutError()
+        lost = submission.lost_workers()
+        if lost > submission.lost:
+            submission.lost = lost
+            raise _WorkerExitedError("A worker process exited abnormally before its jobs were completed")
+
+
+def _collect_results(submission, number_of_jobs, timeout, info, stop_on_error, terminate, unpack,
+                     wait_on_stop):
+    """
+    Yields the index and the result of the jobs in the order they are completed, the result of a failed job is False
+    if stop_on_error is False. The chunks are submitted and the timeout started when the first result is requested.
+    When the generator is finished or closed the results that are not collected are discarded, see _Submission.stop.
+    If wait_on_stop is True and the pool is not terminated here the chunks still running are also waited for until the
+    deadline
+    """
+    # The timeout applies to all chunks together and not to each chunk
+    deadline = None if timeout is None else time.monotonic() + timeout
+    completed = 0
+    terminated = False
+    # The results of the current chunk that are not yet yielded
+    chunk_results = collections.deque()
+    try:
+        while True:
+            try:
+                next_results = _next_chunk(submission, deadline)
+            except multiprocessing.TimeoutError:
+                print("\n ERROR: Timeout\n")
+                print("        To avoid dead lock when workers do not operate as intended")
+                print("        or an unrecoverable error arises a time out time is set.")
+                print(" ")
+                print("        The timeout applies to all jobs of the call together. ")
+                print(" ")
+                print("        This parameter can be manually adjusted as an argument when")
+                print("        calling this module, append timeout='number of seconds'")
+                print("        to adjust when timeout should occur.")
+
+                if stop_on_error:
+                    print("\n\n Terminating child processes")
+                    terminated = True
+                    _terminate_submission(submission, terminate, deadline)
+                    print("-Done\n")
+                    raise
+                # No time remains for the outstanding jobs
+                break
+            except _WorkerExitedError:
+                print("\n ERROR: A worker process exited abnormally before its jobs were completed\n")
+                if stop_on_error:
+                    print("\n\n Terminating child processes")
+                    terminated = True
+                    _terminate_submission(submission, terminate, deadline)
+                    print("-Done\n")
+                    raise
+                # The jobs of the worker are lost and will never be returned, the pool replaces the worker and the
+                # other chunks are still collected
+                continue
+            if next_results is None:
+                break
+
+            chunk_results = collections.deque(next_results)
+            while chunk_results:
+                index, success, value = chunk_results.popleft()
+                if success:
+                    completed += 1
+                    if info:
+                        print(" Completed %s of %s" % (completed, number_of_jobs))
+                        sys.stdout.flush()
+                    yield index, _unpack(value) if unpack else value
+                else:
+                    print("\n\n The following problem was encountered:")
+                    print(type(value))
+                    print(value)
+
+                    print("Stop on error: ", stop_on_error)
+                    if stop_on_error:
+                        print("\n\n Terminating child processes")
+                        terminated = True
+                        _terminate_submission(submission, terminate, deadline)
+                        print("-Done\n")
+                        raise value
+                    if index is not None:
+                        yield index, False
+    finally:
+        submission.stop()
+        _discard_chunk(chunk_results)
+        # The pool is terminated by the caller when the generator is finished, which would lose the shared memory
+        # blocks of the chunks completed but not yet received. A persistent pool discards them when they are received
+        if wait_on_stop and not terminated:
+            submission.wait(deadline)
+
+
+def _terminate_submission(submission, terminate, deadline):
+    """
+    Calls terminate when the chunks still running are completed or the deadline is passed, as the shared memory blocks
+    of the results completed by the workers but not yet received would be lost when the pool is terminated
+    """
+    submission.stop()
+    submission.wait(deadline)
+    terminate()
+
+
+def _ordered_results(job_results, number_of_jobs):
+    """
+    Yields the results from _collect_results in the order of the jobs. Results completed ahead of an outstanding job
+    are kept until that job is completed, and jobs without a result are yielded as False
+    """
+    pending = {}
+    next_index = 0
+    try:
+        for index, value in job_results:
+            pending[index] = value
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+    finally:
+        # Closes job_results directly if this generator is closed
+        job_results.close()
+    for index in range(next_index, number_of_jobs):
+        yield pending.pop(index, False)
+
+
+class _PackedResult(object):
+    """
+    A result pickled with protocol 5 in a worker process. The out-of-band buffers of the result, for instance the data
+    of numpy arrays, are stored in the shared memory block with the name name and have the sizes given by buffers
+    """
+    def __init__(self, data, name, buffers):
+        self.data = data
+        self.name = name
+        self.buffers = buffers
+
+
+def _array_bytes(result, limit):
+    """
+    Returns the number of bytes of the numpy arrays in a result, including arrays in lists, tuples and dicts. The
+    counting stops when limit is reached
+    """
+    if isinstance(result, np.ndarray):
+        return 0 if result.dtype.hasobject else result.nbytes
+    if isinstance(result, dict):
+        result = result.values()
+    elif not isinstance(result, (list, tuple)):
+        return 0
+    size = 0
+    for item in result:
+        size += _array_bytes(item, limit)
+        if size >= limit:
+            break
+    return size
+
+
+def _pack(result):
+    """
+    Pickles a result in a worker process. Large out-of-band buffers are copied to shared memory so that only the pickle
+    data and the name of the shared memory block has to be sent through the result pipe of the pool. Other results are
+    returned unchanged and pickled by the pool
+    """
+    if _array_bytes(result, _SHM_RESULT_SIZE) < _SHM_RESULT_SIZE:
+        return result
+    buffers = []
+    data = io.BytesIO()
+    ForkingPickler(data, 5, True, buffers.append).dump(result)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+    sizes = [raw.nbytes for raw in raw_buffers]
+    if sum(sizes) < _SHM_RESULT_SIZE:
+        return result
+    shm = SharedMemory(create=True, size=sum(sizes))
+    offset = 0
+    for raw, size in zip(raw_buffers, sizes):
+        shm.buf[offset:offset + size] = raw
+        offset += size
+    shm.close()
+    return _PackedResult(data.getvalue(), shm.name, sizes)
+
+
+def _unpack(result, shared_memory=None):
+    """
+    Unpickles a result packed by _pack, results that were not packed are returned unchanged. The buffers are copied from
+    shared memory and the block is unlinked. If a list shared_memory is given the result is instead created as a view
+    of the shared memory block, which is appended to the list and has to be closed by the caller when the result is no
+    longer used
+    """
+    if not isinstance(result, _PackedResult):
+        return result
+    shm = SharedMemory(name=result.name)
+    shm.unlink()
+    if shared_memory is not None:
+        shared_memory.append(shm)
+    try:
+        buffers = []
+        offset = 0
+        for size in result.buffers:
+            if shared_memory is None:
+                buffers.append(bytearray(shm.buf[offset:offset + size]))
+            else:
+                buffers.append(shm.buf[offset:offset + size])
+            offset += size
+    finally:
+        if shared_memory is None:
+            shm.close()
+    return pickle.loads(result.data, buffers=buffers)
+
+
+def _discard(results):
+    """
+    Unlinks the shared memory blocks of packed results that will never be unpacked, other results are ignored
+    """
+    for result in results:
+        if isinstance(result, _PackedResult):
+            try:
+                shm = SharedMemory(name=result.name)
+            except FileNotFoundError:
+                continue
+            shm.close()
+            shm.unlink()
+
+
+def _stack_results(results, axis):
+    """
+    Concatenates the packed results from apply along axis. Arrays returned in shared memory are copied directly to the
+    concatenated array without first being copied out of the shared memory
+    """
+    shared_memory = []
+    arrays = []
+    try:
+        for result in results:
+            arrays.append(np.atleast_1d(_unpack(result, shared_memory)))
+        out_shape = list(arrays[0].shape)
+        out_shape[axis] = sum(array.shape[axis] for array in arrays)
+        out = np.empty(out_shape, dtype=np.result_type(*arrays))
+        return np.concatenate(arrays, axis=axis, out=out)
+    finally:
+        del arrays[:]
+        for shm in shared_memory:
+            _close_shm(shm)
+
+
+class _ShmView(object):
+    """
+    A slice along an axis of an array stored in shared memory. Only the name of the shared memory block and the slice
+    are pickled when the view is sent to a worker, where the slice is reconstructed as a view without copying the data
+    """
+    def __init__(self, name, dtype, shape, axis, start, stop):
+        self.name = name
+        self.dtype = dtype
+        self.shape = shape
+        self.axis = axis
+        self.start = start
+        self.stop = stop
+        self.shm = None
+        self.array = None
+
+    def __getstate__(self):
+        return self.name, self.dtype, self.shape, self.axis, self.start, self.stop
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+        self.shm = SharedMemory(name=self.name)
+        index = [slice(None)]*len(self.shape)
+        index[self.axis] = slice(self.start, self.stop)
+        self.array = _shm_array(self.shm, self.dtype, self.shape)[tuple(index)]
+
+    def close(self):
+        self.array = None
+        _close_shm(self.shm)
+
+
+# Shared memory blocks that could not be closed as arrays still refer to them, see _close_shm
+_UNCLOSED_SHM = []
+
+
+def _close_shm(shm):
+    """
+    Closes a shared memory block. If arrays still refer to the memory, for instance when a function returns a view of
+    its input, the block is kept and closing is tried again on the next call
+    """
+    _UNCLOSED_SHM.append(shm)
+    for block in list(_UNCLOSED_SHM):
+        try:
+            block.close()
+            _UNCLOSED_SHM.remove(block)
+        except BufferError:
+            pass
+
+
+def _to_shm(array):
+    """
+    Copies an array to a new shared memory block that is returned, the caller is responsible for unlinking the block
+    """
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    _shm_array(shm, array.dtype, array.shape)[...] = array
+    return shm
+
+
+def _shm_array(shm, dtype, shape):
+    """
+    Returns an array using the memory of a shared memory block. The array keeps the buffer of the block exported so
+    that the block cannot be closed while the array is alive
+    """
+    return np.frombuffer(shm.buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _split_indices(n, k):
+    """
+    Returns lists with the start and stop indices of k chunks of n items, the chunks have the same sizes as the ones
+    given by np.array_split
+    """
+    sizes = np.full(k, n // k)
+    sizes[:n % k] += 1
+    stops = np.cumsum(sizes)
+    return (stops - sizes).tolist(), stops.tolist()
+
+
+def _split_sequence(data, cpus):
+    """
+    Splits data having a length in cpus chunks. Sequences are sliced while other iterables, for instance sets and
+    dictionary views, are consumed once with itertools.islice
+    """
+    starts, stops = _split_indices(len(data), cpus)
+    try:
+        return [data[start:stop] for start, stop in zip(starts, stops)]
+    except TypeError:
+        iterator = iter(data)
+        return [list(itertools.islice(iterator, stop - start)) for start, stop in zip(starts, stops)]
+
+
+def _result_axis(data_list, axis_split):
+    """
+    Returns the axis along which the results of apply are concatenated, the axis that the first item in data_list is
+    split along
+    """
+    axis = axis_split if isinstance(axis_split, Integral) else axis_split[0]
+    if isinstance(data_list[0], np.ndarray) and len(data_list[0].shape) == 1:
+        axis = 0
+    return axis
+
+
+def _split_data(data_list, axis_split, cpus):
+    """
+    Splits each item in data_list in cpus chunks. Numpy arrays are copied to shared memory once and the chunks are
+    sent to the workers as _ShmView objects, other iterables are sliced.
+
+    :return:    A list with the chunks of data_list for each cpu and a list with the shared memory blocks created that
+                has to be unlinked when the processing is finished
+    """
+    if isinstance(axis_split, Integral):
+        axis_split = [axis_split]*len(data_list)
+    data_chunks_list = [list() for _ in range(cpus)]
+    shared_memory = []
+    try:
+        for data, axis in zip(data_list, axis_split):
+            if isinstance(data, np.ndarray) and not data.dtype.hasobject:
+                if len(data.shape) == 1:
+                    axis = 0
+                axis = axis % len(data.shape)
+                shm = _to_shm(data)
+                shared_memory.append(shm)
+                data_chunks = [_ShmView(shm.name, data.dtype, data.shape, axis, start, stop)
+                               for start, stop in zip(*_split_indices(data.shape[axis], cpus))]
+            elif isinstance(data, np.ndarray):
+                if len(data.shape) == 1:
+                    axis = 0
+                data_chunks = np.array_split(data, cpus, axis=axis)
+            else:
+                data_chunks = _split_sequence(data, cpus)
+            for i, chunk in enumerate(data_chunks):
+                data_chunks_list[i].append(chunk)
+    except:
+        _unlink_shm(shared_memory)
+        raise
+    return data_chunks_list, shared_memory
+
+
+def _unlink_shm(shared_memory):
+    for shm in shared_memory:
+        shm.close()
+        shm.unlink()
+
+
+def _payload(function, keyword_data, shared_memory):
+    """
+    Pickles the function and the keyword arguments shared by all jobs of a batch once, instead of once for each job,
+    together with a token identifying the batch. Payloads of at least _SHM_PAYLOAD_SIZE bytes are stored in a shared
+    memory block, that is appended to shared_memory, so that only the name of the block is sent with each job and the
+    payload is copied once to each worker instead of once per job
+    """
+    token = (os.getpid(), next(_BATCH_COUNTER))
+    data = ForkingPickler.dumps((function, keyword_data))
+    if len(data) < _SHM_PAYLOAD_SIZE:
+        return token, bytes(data)
+    shm = SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    shared_memory.append(shm)
+    return token, shm.name
+
+
+def _load_payload(payload):
+    """
+    Unpickles the function and the keyword arguments of a payload created by _payload in a worker process. The latest
+    payload is cached so that a worker running several jobs of the same batch only unpickles it once
+    """
+    global _PAYLOAD
+    token, data = payload
+    if _PAYLOAD[0] != token:
+        if isinstance(data, str):
+            shm = SharedMemory(name=data)
+            try:
+                # Trailing bytes of the block after the pickled data are ignored by pickle
+                _PAYLOAD = (token, pickle.loads(shm.buf))
+            finally:
+                _close_shm(shm)
+        else:
+            _PAYLOAD = (token, pickle.loads(data))
+    return _PAYLOAD[1]
+
+
+def _apply_chunk(payload, data_chunks):
+    """
+    Calls function with the chunks of the data in a worker process, chunks stored in shared memory are passed as views
+    """
+    function, keyword_data = _load_payload(payload)
+    try:
+        return function(*[chunk.array if isinstance(chunk, _ShmView) else chunk for chunk in data_chunks],
+                        **keyword_data)
+    finally:
+        for chunk in data_chunks:
+            if isinstance(chunk, _ShmView):
+                chunk.close()
+
+
+def _loop_chunk(payload, data_list):
+    function, keyword_data = _load_payload(payload)
+    return _loop_func(function, data_list, keyword_data)
+
 
 class MultiProcesser:
-    def __init__(self, cpus=multiprocessing.cpu_count(), info=False, stop_on_error=True, delay=0.3):
+    def __init__(self, cpus=_default_cpus(), info=False, stop_on_error=True, delay=0, max_in_flight=None,
+                 initializer=None, initargs=()):
         # Verify that the number of processes is not more that available
-        if cpus > multiprocessing.cpu_count():
-            cpus = multiprocessing.cpu_count()
+        if cpus > _default_cpus():
+            cpus = _default_cpus()
         self.cpus = cpus
         self.worker_pool = None
         self.delay = delay
+        self.max_in_flight = max_in_flight
+        # Called with initargs once in each worker process when the pool is started, for instance to do expensive
+        # imports only once per worker and not in every job
+        self.initializer = initializer
+        self.initargs = initargs
         self.info = info
         self.stop_on_error = stop_on_error
+        # Set by the module level functions that terminate the pool after the call, see _collect_results
+        self._wait_on_stop = False
 
     def start(self):
         if self.worker_pool is not None:
             self.terminate()
-        self.worker_pool = multiprocessing.Pool(processes=self.cpus)
+        self.worker_pool = _create_pool(self.cpus, self.initializer, self.initargs)
 
-    def run_jobs(self, jobs, timeout):
+    def run_jobs(self, jobs, timeout, unpack=True, chunksize=None, iter_results=False):
         cpus = self.cpus
+        # The pool is created on the first call and then kept alive until close or terminate is called
+        if self.worker_pool is None:
+            self.start()
         # Start timer
         start_time = time.time()
 
-        try:
-            #      Assemble the command for each job
-            job_args = []
-            for job in jobs:
-                function = job[0]
-                arguments = job[1]
-                kwarguments = job[2]
-
-                if (arguments is None) and (kwarguments is None):
-                    job_args.append([function, [], {}])
-                elif arguments is None:
-                    job_args.append([function, [], kwarguments])
-                elif kwarguments is None:
-                    job_args.append([function, arguments, {}])
-                else:
-                    job_args.append([function, arguments, kwarguments])
-
-        except:
-            print(" ERROR: multiProcessor - The received arguments could not be interpreted")
-            print("        The data must be on the following form:")
-            print("        [  ( functionReference, arguments, key word arguments as dictionary )\n\t , "
-                  "( myFun,[x,y,z], {'a':2 ,'b':3} ) \n\t ,  (myFun2, None, None),   ]\n")
-            raise
+        job_args = _job_args(jobs)
 
         try:
-            queue = []
-            for job_arg in job_args:
-                function = job_arg[0]
-                arguments = job_arg[1]
-                kwarguments = job_arg[2]
-                queue.append(self.worker_pool.apply_async(function, arguments, kwarguments))
-                time.sleep(self.delay)
-            # Get results
-            results = []
-
-            for i, item in enumerate(queue):
-                try:  # noinspection PyBroadException
-                    results.append(item.get(timeout=timeout))
-                    if self.info:
-                        print(" Completed %s of %s" % (i + 1, len(queue)))
-                        sys.stdout.flush()
-                except multiprocessing.TimeoutError:
-                    print("\n ERROR: Timeout\n")
-                    print("        To avoid dead lock when workers do not operate as intended")
-                    print("        or an unrecoverable error arises a time out time is set.")
-                    print(" ")
-                    print("        The default timeout is 10s. ")
-                    print(" ")
-                    print("        This parameter can be manually adjusted as an argument when")
-                    print("        calling this module, append timeout='number of seconds'")
-                    print("        to adjust when timeout should occur.")
-
-                    if self.stop_on_error:
-                        print("\n\n Terminating child processes")
-                        self.worker_pool.terminate()
-                        print("-Done\n")
-                        raise
-                    else:
-                        results.append(False)
-                        continue
-                except:
-                    print("\n\n The following problem was encountered:")
-                    print(sys.exc_info()[0])  # - Exit type:', sys.exc_info()[0]
-                    print(sys.exc_info()[1])  # - Exit type:', sys.exc_info()[0]
-
-                    print("Stop on error: ", self.stop_on_error)
-                    if self.stop_on_error:
-                        print("\n\n Terminating child processes")
-                        self.worker_pool.terminate()
-                        print("-Done\n")
-                        raise
-                    else:
-                        results.append(False)
-                        continue
+            results = _run_jobs(self.worker_pool, job_args, cpus, timeout, self.info, self.stop_on_error,
+                                self.terminate, self.delay, self.max_in_flight, unpack, chunksize, iter_results,
+                                self._wait_on_stop)
+            if iter_results:
+                return results
 
             end_time = float(round((time.time() - start_time)*10))/10
             if self.info:
@@ -116,29 +767,39 @@ class MultiProcesser:
             raise
 
     def process_function(self, function, data_list, keyword_data=None, force_multiprocessing=False,
-                         timeout=10):
+                         timeout=None, chunksize=None, iter_results=False):
         if keyword_data is None:
             keyword_data = {}
-        if self.cpus > 1 or force_multiprocessing:
-            data_chunks_list = []
-            start = 0
-            for i in range(self.cpus):
-                tot_size = len(data_list)
-                if i < tot_size % self.cpus:
-                    size = tot_size // self.cpus + 1
-                else:
-                    size = tot_size // self.cpus
-                data_chunks_list.append(data_list[start:start + size])
-                start += size
-            job_list = [(_loop_func, (function, data_chunk), {"keyword_data": keyword_data})
-                        for data_chunk in data_chunks_list]
-            results = self.run_jobs(job_list, timeout=timeout)
+        # No more chunks than items are created. A single item is processed in this process, unless
+        # force_multiprocessing is given, as nothing would run in parallel
+        cpus = max(min(self.cpus, len(data_list)), 1)
+        if cpus > 1 or force_multiprocessing:
+            # If chunksize is given the data is split in chunks of at most chunksize items that are handed out to the
+            # workers as they become free, which balances the load when the time per item varies
+            if chunksize is not None:
+                cpus = max(-(-len(data_list) // max(1, chunksize)), 1)
+            # Numpy arrays are sent to the workers in shared memory, see _split_data
+            data_chunks_list, shared_memory = _split_data([data_list], 0, cpus)
+            try:
+                payload = _payload(function, keyword_data, shared_memory)
+                job_list = [(_loop_chunk, (payload, data_chunk), None) for data_chunk, in data_chunks_list]
+                results = self.run_jobs(job_list, timeout=timeout, chunksize=1, iter_results=iter_results)
+            except:
+                _unlink_shm(shared_memory)
+                raise
+            if iter_results:
+                return _ResultIterator(itertools.chain.from_iterable(results), results.close,
+                                       partial(_unlink_shm, shared_memory))
+            _unlink_shm(shared_memory)
             return [item for sublist in results for item in sublist]
+        elif self.cpus > 1:
+            results = _loop_func(function, data_list, keyword_data)
         else:
-            return [function(data, **keyword_data) for data in data_list]
+            results = [function(data, **keyword_data) for data in data_list]
+        return iter(results) if iter_results else results
 
     def apply(self, function, data_list, keyword_data=None, axis_split=0, force_multiprocessing=False,
-              timeout=10):
+              timeout=None):
         """
           Multiprocessing one or several arrays given in the *args data in the function function
           :param function:              Function to process
@@ -156,169 +817,116 @@ class MultiProcesser:
           :param force_multiprocessing  if True, a new process will be started even though num_cpus=1
 
 
-          :param timeout:               This is a timeout value to avoid dead lock of processes. If the process takes
-                                        longer than the prescribed value a timeOutError will be raised and the child
-                                        process terminated.
+          :param timeout:               Maximum time in seconds for all jobs of the call together, not for each job.
+                                        If the jobs are not completed within this time a TimeoutError is raised and
+                                        the child processes terminated. None, the default, waits without a limit.
 
-          :return:                      A numpy array with return values from function
+          :return:                      A numpy array with return values from function concatenated along the axis
+                                        that the first item in data_list is split along
           """
         if keyword_data is None:
             keyword_data = {}
         if self.cpus > 1 or force_multiprocessing:
-            if isinstance(axis_split, Integral):
-                axis_split = [axis_split]*len(data_list)
-            data_chunks_list = [list() for _ in range(self.cpus)]
-            for data, axis in zip(data_list, axis_split):
-                if isinstance(data, np.ndarray):
-                    if len(data.shape) == 1:
-                        axis = 0
-                    data_chunks = np.array_split(data, self.cpus, axis=axis)
-                else:
-                    data_chunks = []
-                    start = 0
-                    for i in range(self.cpus):
-                        tot_size = len(data)
-                        if i < tot_size % self.cpus:
-                            size = tot_size // self.cpus + 1
-                        else:
-                            size = tot_size // self.cpus
-                        data_chunks.append(data[start:start + size])
-                        start += size
-                for i, chunk in enumerate(data_chunks):
-                    data_chunks_list[i].append(chunk)
-            job_list = [(function, data_chunks_list[i], keyword_data) for i in range(self.cpus)]
-            results = self.run_jobs(job_list, timeout=timeout)
-            return np.vstack(results)
+            data_chunks_list, shared_memory = _split_data(data_list, axis_split, self.cpus)
+            try:
+                payload = _payload(function, keyword_data, shared_memory)
+                job_list = [(_apply_chunk, (payload, data_chunks), None) for data_chunks in data_chunks_list]
+                results = self.run_jobs(job_list, timeout=timeout, unpack=False)
+            finally:
+                _unlink_shm(shared_memory)
+            return _stack_results(results, _result_axis(data_list, axis_split))
         else:
             return function(*data_list, **keyword_data)
 
+    def close(self):
+        """
+        Waits for the submitted jobs to finish and shuts down the worker pool
+        """
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool.join()
+            self.worker_pool = None
+
     def terminate(self):
-        self.worker_pool.terminate()
-        self.worker_pool.join()
+        """
+        Stops the worker pool immediately without waiting for outstanding jobs
+        """
+        if self.worker_pool is not None:
+            _terminate_pool(self.worker_pool)
+            self.worker_pool = None
 
 
-def multi_processer(jobs, cpus=multiprocessing.cpu_count(), info=False, timeout=10, stop_on_error=True, delay=0.3,
-                    worker_pool=None):
+def multi_processer(jobs, cpus=_default_cpus(), info=False, timeout=None, stop_on_error=True, delay=0,
+                    worker_pool=None, max_in_flight=None, initializer=None, initargs=(), chunksize=None,
+                    iter_results=False):
     """
 
     Jobs is expected to be of list/array type and be structured as:
     [  ( functionReference, arguments, key word arguments as dictionary ) , ... ]
+    On other platforms than Linux the functions have to be defined at module level as the workers are started with
+    forkserver and import the functions instead of inheriting them.
     
     stop_on_error: [True]  If an error is encountered the processing of all child processes is to be stopped
                    and the error is raised.
                    [False] If an error is encountered while processing, the error will be ignored and the
                    corresponding place in the result vector will be replaced with False.
     
-    timeout:     This is a timeout value to avoid dead lock of processes. If the process takes longer than 
-                 the prescribed value a timeOutError will be raised and the child process terminated.
+    timeout:     Maximum time in seconds for all jobs together, not for each job. If all jobs are not completed
+                 within this time a TimeoutError is raised and the child processes terminated. None, the default,
+                 waits without a limit.
     
     info:        Just add some output regarding progress
 
-    worker_pool:           Use an existing worker pool to avoid creating new for each call
+    worker_pool: Use an existing worker pool to avoid creating new for each call, a pool created by the call is
+                 terminated when the results are collected
     
-    delay:       Delay between submission of jobs
+    delay:       Delay between submission of chunks of jobs, the jobs are submitted without delay by default
+
+    max_in_flight: Maximum number of chunks of jobs submitted to the pool but not yet collected, None gives 4*cpus
+
+    initializer: Function called with initargs once in each worker process of the pool created by the call, not used
+                 if worker_pool is given
+
+    chunksize:   Number of jobs submitted together to a worker, by default the jobs are submitted in about 4*cpus
+                 chunks
+
+    iter_results: If True an iterator is returned that yields the results in the order of the jobs as they are
+                  completed, so that all results do not have to be kept in memory at the same time
     """
 
     # Verify that the number of processes is not more that available    
-    if cpus > multiprocessing.cpu_count():
-        cpus = multiprocessing.cpu_count()
-    if len(jobs) < cpus:
-        cpus = len(jobs)
+    if cpus > _default_cpus():
+        cpus = _default_cpus()
 
     # Start timer
     start_time = time.time()
     
-    try:
-        #      Assemble the command for each job
-        job_args = []
-        for job in jobs:
-            function = job[0]
-            arguments = job[1] 
-            kwarguments = job[2]
-            
-            if (arguments is None) and (kwarguments is None):
-                job_args.append([function, [], {}])
-            elif arguments is None:
-                job_args.append([function, [], kwarguments])            
-            elif kwarguments is None:
-                job_args.append([function, arguments, {}])            
-            else:                 
-                job_args.append([function, arguments, kwarguments])
-                
-    except:
-        print(" ERROR: multiProcessor - The received arguments could not be interpreted")
-        print("        The data must be on the following form:")
-        print("        [  ( functionReference, arguments, key word arguments as dictionary )\n\t , "
-              "( myFun,[x,y,z], {'a':2 ,'b':3} ) \n\t ,  (myFun2, None, None),   ]\n")
-        raise
+    job_args = _job_args(jobs)
+    if len(job_args) < cpus:
+        cpus = max(len(job_args), 1)
 
     try:
         # Spawn worker Pool
         pool_created = False
         if worker_pool is None:
-            worker_pool = multiprocessing.Pool(processes=cpus)
+            worker_pool = _create_pool(cpus, initializer, initargs)
             pool_created = True
 
-        # Submit jobs to queue
-        queue = []
-        for job_arg in job_args:
-            function = job_arg[0]
-            arguments = job_arg[1]
-            kwarguments = job_arg[2]
-            queue.append(worker_pool.apply_async(function, arguments, kwarguments))
-            time.sleep(delay)
-
-        # Get results
-        results = []
-        
-        for i, item in enumerate(queue):
-            try:   # noinspection PyBroadException
-                results.append(item.get(timeout=timeout))
-                if info:
-                    print(" Completed %s of %s" % (i+1, len(queue)))
-                    sys.stdout.flush()
-            except multiprocessing.TimeoutError:
-                print("\n ERROR: Timeout\n")
-                print("        To avoid dead lock when workers do not operate as intended")
-                print("        or an unrecoverable error arises a time out time is set.")
-                print(" ")
-                print("        The default timeout is 10s. ")
-                print(" ")
-                print("        This parameter can be manually adjusted as an argument when")
-                print("        calling this module, append timeout='number of seconds'")
-                print("        to adjust when timeout should occur.")
-
-                if stop_on_error:
-                    print("\n\n Terminating child processes")
-                    worker_pool.terminate()
-                    if pool_created:
-                        worker_pool.join()
-                    print("-Done\n")
-                    raise
-                else:
-                    results.append(False)
-                    continue
-            except:
-                print("\n\n The following problem was encountered:")
-                print(sys.exc_info()[0])  # - Exit type:', sys.exc_info()[0]
-                print(sys.exc_info()[1])  # - Exit type:', sys.exc_info()[0]
-        
-                print("Stop on error: ", stop_on_error)
-                if stop_on_error:
-                    print("\n\n Terminating child processes")
-                    worker_pool.terminate()
-                    if pool_created:
-                        worker_pool.join()
-                    print("-Done\n")
-                    raise
-                else:
-                    results.append(False)
-                    continue
-
-        # Close queue and kill workers
+        try:
+            results = _run_jobs(worker_pool, job_args, cpus, timeout, info, stop_on_error,
+                                partial(_terminate_pool, worker_pool), delay, max_in_flight, chunksize=chunksize,
+                                iter_results=iter_results, wait_on_stop=pool_created)
+        except:
+            if pool_created:
+                _terminate_pool(worker_pool)
+            raise
         if pool_created:
-            worker_pool.close()
-            worker_pool.join()
+            # Kill the workers when the results are collected, jobs abandoned after a timeout are not waited for
+            if iter_results:
+                return _ResultIterator(results, partial(_terminate_pool, worker_pool))
+            _terminate_pool(worker_pool)
+        if iter_results:
+            return results
 
         end_time = float(round((time.time() - start_time)*10))/10
         if info:
@@ -332,27 +940,82 @@ def multi_processer(jobs, cpus=multiprocessing.cpu_count(), info=False, timeout=
         raise
 
 
+class _ResultIterator(object):
+    """
+    Iterator over results that calls the cleanup functions when it is exhausted, closed or garbage collected, also if
+    the iteration is never started, for instance to unlink shared memory or terminate a worker pool that is used until
+    the last result is collected
+    """
+    def __init__(self, results, *cleanups):
+        self.results = iter(results)
+        # The finalizer must not refer to self, otherwise the iterator would never be garbage collected
+        self._finalizer = weakref.finalize(self, _close_results, self.results, cleanups)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.results)
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        self._finalizer()
+
+
+def _close_results(results, cleanups):
+    try:
+        # A generator is closed before the cleanup, for instance to let it discard its outstanding results first
+        if hasattr(results, "close"):
+            results.close()
+    finally:
+        for cleanup in cleanups:
+            cleanup()
+
+
 def _loop_func(function, data_list, keyword_data):
-    results = []
-    for data in data_list:
+    if isinstance(data_list, _ShmView):
+        # The rows are views of the shared memory, the view is closed when the loop is finished
         try:
-            len(data)
-        except TypeError:
-            data = (data, )
-        results.append(function(*data, **keyword_data))
-    return results
+            return _loop_func(function, data_list.array, keyword_data)
+        finally:
+            data_list.close()
+    if len(data_list) == 0:
+        return []
+    # The items are either all sequences of arguments or all single arguments, which is determined once from the first
+    # item instead of for every item
+    try:
+        len(next(iter(data_list)))
+    except TypeError:
+        return [function(data, **keyword_data) for data in data_list]
+    return [function(*data, **keyword_data) for data in data_list]
 
 
-def process_function(function, data_list, cpus, keyword_data=None, force_multiprocessing=False,
-                     info=False, timeout=10, stop_on_error=True, delay=0.3):
-    m = MultiProcesser(cpus, info=info, stop_on_error=stop_on_error, delay=delay)
-    result = m.process_function(function, data_list, keyword_data, force_multiprocessing=force_multiprocessing, timeout=timeout)
-    # m.terminate()
-    return result
+def process_function(function, data_list, cpus=_default_cpus(), keyword_data=None, force_multiprocessing=False,
+                     info=False, timeout=None, stop_on_error=True, delay=0, max_in_flight=None, chunksize=None,
+                     iter_results=False, initializer=None, initargs=()):
+    m = MultiProcesser(cpus, info=info, stop_on_error=stop_on_error, delay=delay, max_in_flight=max_in_flight,
+                       initializer=initializer, initargs=initargs)
+    m._wait_on_stop = True
+    # The pool of m is only started if the function is run in worker processes and is terminated when the results are
+    # collected
+    try:
+        results = m.process_function(function, data_list, keyword_data, force_multiprocessing=force_multiprocessing,
+                                     timeout=timeout, chunksize=chunksize, iter_results=iter_results)
+    except:
+        m.terminate()
+        raise
+    if iter_results:
+        return _ResultIterator(results, m.terminate)
+    m.terminate()
+    return results
 
 
-def apply(function, data_list, cpus, keyword_data=None, axis_split=0, force_multiprocessing=False,
-          info=False, timeout=10, stop_on_error=True, delay=0.3, worker_pool=None):
+def apply(function, data_list, cpus=_default_cpus(), keyword_data=None, axis_split=0, force_multiprocessing=False,
+          info=False, timeout=None, stop_on_error=True, delay=0, worker_pool=None, max_in_flight=None, initializer=None,
+          initargs=()):
     """
     Multiprocessing one or several arrays given in the *args data in the function function
     :param function:              Function to process
@@ -361,7 +1024,8 @@ def apply(function, data_list, cpus, keyword_data=None, axis_split=0, force_mult
                                   parallel
     :param keyword_data:          A dict with additional keyword arguments to function that is common for all points
 
-    :param cpus                   int giving the number of cpus to be used
+    :param cpus                   int giving the number of cpus to be used, by default the number of cpus that the
+                                  process is allowed to run on
 
     :param axis_split             if data_list contains multidimensional arrays, axis_split can be given as an int or
                                   a list having the same length as data_list along which axis will be processed. For
@@ -373,45 +1037,37 @@ def apply(function, data_list, cpus, keyword_data=None, axis_split=0, force_mult
                                   [False] If an error is encountered while processing, the error will be ignored and the
                                   corresponding place in the result vector will be replaced with False.
 
-    :param timeout:               This is a timeout value to avoid dead lock of processes. If the process takes longer
-                                  than the prescribed value a timeOutError will be raised and the child process
-                                  terminated.
+    :param timeout:               Maximum time in seconds for all jobs of the call together, not for each job. If
+                                  the jobs are not completed within this time a TimeoutError is raised and the child
+                                  processes terminated. None, the default, waits without a limit.
 
     :param info:                  Just add some output regarding progress
 
-    :param delay:                 Delay between submission of jobs
+    :param delay:                 Delay between submission of jobs, no delay by default
 
     :param worker_pool:           Use an existing worker pool to avoid creating new for each call
 
-    :return:                      A numpy array with return values from function
+    :param max_in_flight:         Maximum number of chunks of jobs submitted to the pool but not yet collected, None
+                                  gives 4*cpus
+
+    :param initializer:           Function called with initargs once in each worker process of the pool created by
+                                  the call, not used if worker_pool is given
+
+    :param initargs:              Arguments to initializer
+
+    :return:                      A numpy array with return values from function concatenated along the axis that the
+                                  first item in data_list is split along
     """
-    if keyword_data is None:
-        keyword_data = {}
-    if cpus > 1 or force_multiprocessing:
-        if isinstance(axis_split, Integral):
-            axis_split = [axis_split]*len(data_list)
-        data_chunks_list = [list() for _ in range(cpus)]
-        for data, axis in zip(data_list, axis_split):
-            if isinstance(data, np.ndarray):
-                if len(data.shape) == 1:
-                    axis = 0
-                data_chunks = np.array_split(data, cpus, axis=axis)
-            else:
-                data_chunks = []
-                start = 0
-                for i in range(cpus):
-                    tot_size = len(data)
-                    if i < tot_size % cpus:
-                        size = tot_size // cpus + 1
-                    else:
-                        size = tot_size // cpus
-                    data_chunks.append(data[start:start + size])
-                    start += size
-            for i, chunk in enumerate(data_chunks):
-                data_chunks_list[i].append(chunk)
-        job_list = [(function, data_chunks_list[i], keyword_data) for i in range(cpus)]
-        results = multi_processer(job_list, cpus=cpus, info=info, timeout=timeout, stop_on_error=stop_on_error,
-                                  delay=delay, worker_pool=worker_pool)
-        return np.vstack(results)
-    else:
-        return function(*data_list, **keyword_data)
+    m = MultiProcesser(cpus, info=info, stop_on_error=stop_on_error, delay=delay, max_in_flight=max_in_flight,
+                       initializer=initializer, initargs=initargs)
+    if worker_pool is not None:
+        m.worker_pool = worker_pool
+        return m.apply(function, data_list, keyword_data, axis_split=axis_split,
+                       force_multiprocessing=force_multiprocessing, timeout=timeout)
+    # The pool of m is only started if the function is run in worker processes
+    m._wait_on_stop = True
+    try:
+        return m.apply(function, data_list, keyword_data, axis_split=axis_split,
+                       force_multiprocessing=force_multiprocessing, timeout=timeout)
+    finally:
+        m.terminate()
@@ -0,0 +1,110 @@
+import gc
+import multiprocessing
+import os
+import pickle
+import time
+import unittest
+
+import numpy as np
+
+from multiprocesser import multiprocesser as mp
+
+# Large enough for the results and the input data to be sent through shared memory
+_SIZE = 2*mp._SHM_RESULT_SIZE//8
+
+
+def _array(i):
+    return np.full(_SIZE, float(i))
+
+
+def _array_or_fail(i):
+    if i == 3:
+        raise ValueError("job 3 failed")
+    return _array(i)
+
+
+def _array_or_sleep(i):
+    if i % 2:
+        time.sleep(10)
+    return _array(i)
+
+
+def _double(x):
+    return 2*x
+
+
+def _shm_blocks():
+    return set(name for name in os.listdir("/dev/shm") if name.startswith("psm_"))
+
+
+@unittest.skipUnless(os.path.isdir("/dev/shm"), "shared memory blocks are not listed in /dev/shm")
+class TestSharedMemoryCleanup(unittest.TestCase):
+    """
+    Checks that no shared memory blocks are left when a call is completed, fails, times out or when an iterator over
+    the results is closed or never started
+    """
+    def setUp(self):
+        self.blocks = _shm_blocks()
+
+    def assertNoNewBlocks(self):
+        gc.collect()
+        self.assertEqual(_shm_blocks() - self.blocks, set())
+
+    def test_completed(self):
+        results = mp.multi_processer([(_array, [i], {}) for i in range(6)], cpus=2, chunksize=1)
+        self.assertEqual([result[0] for result in results], list(range(6)))
+        data = np.arange(2.*_SIZE)
+        self.assertTrue(np.array_equal(mp.process_function(_double, data, cpus=2, force_multiprocessing=True),
+                                       2*data))
+        self.assertNoNewBlocks()
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            mp.multi_processer([(_array_or_fail, [i], {}) for i in range(6)], cpus=2, chunksize=1)
+        self.assertNoNewBlocks()
+
+    def test_timeout(self):
+        with self.assertRaises(multiprocessing.TimeoutError):
+            mp.multi_processer([(_array_or_sleep, [i], {}) for i in range(6)], cpus=2, chunksize=1, timeout=1)
+        self.assertNoNewBlocks()
+
+    def test_iterator_closed(self):
+        results = mp.multi_processer([(_array, [i], {}) for i in range(6)], cpus=2, chunksize=1, iter_results=True)
+        self.assertEqual(next(results)[0], 0)
+        results.close()
+        self.assertNoNewBlocks()
+
+        data = np.arange(2.*_SIZE)
+        results = mp.process_function(_double, data, cpus=2, force_multiprocessing=True, iter_results=True)
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertNoNewBlocks()
+
+    def test_iterator_never_started(self):
+        results = mp.multi_processer([(_array, [i], {}) for i in range(6)], cpus=2, chunksize=1, iter_results=True)
+        del results
+        self.assertNoNewBlocks()
+
+        data = np.arange(2.*_SIZE)
+        results = mp.process_function(_double, data, cpus=2, force_multiprocessing=True, iter_results=True)
+        del results
+        self.assertNoNewBlocks()
+
+        m = mp.MultiProcesser(2)
+        try:
+            results = m.run_jobs([(_array, [i], {}) for i in range(6)], timeout=None, iter_results=True)
+            del results
+            self.assertNoNewBlocks()
+        finally:
+            m.terminate()
+
+    def test_unpicklable_payload(self):
+        data = np.arange(2.*_SIZE)
+        # Local functions raise AttributeError on some python versions
+        with self.assertRaises((pickle.PicklingError, AttributeError)):
+            mp.process_function(lambda x: x, data, cpus=2, force_multiprocessing=True)
+        self.assertNoNewBlocks()
+
+
+if __name__ == "__main__":
+    unittest.main()